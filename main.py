@@ -1,15 +1,27 @@
 from flask import Flask
-from threading import Thread
+from threading import Thread, get_ident
 import discord
 from discord import Option
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ui import Button, View
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
 import os
 import asyncio
 import json
 import random
-from datetime import datetime, timedelta
+import string
+import sys
+import time
+import tracemalloc
+import traceback
+import weakref
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from math_solver import async_solve_math, start_math_pool
 
 # =============================
 # KEEP ALIVE SERVER
@@ -31,9 +43,13 @@ def keep_alive():
 # =============================
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel("gemini-2.5-flash")
+# Comma-separated keys (one per key or project); falls back to the single GEMINI_API_KEY
+GEMINI_API_KEYS = [key.strip() for key in os.getenv("GEMINI_API_KEYS", GEMINI_API_KEY or "").split(",") if key.strip()]
+# Optional local requests-per-minute cap per key (e.g. 10 on the free tier); unset leaves throttling to the server
+GEMINI_RPM_PER_KEY = int(os.getenv("GEMINI_RPM_PER_KEY")) if os.getenv("GEMINI_RPM_PER_KEY") else None
+GEMINI_MODEL = "gemini-2.5-flash"
+# Comma-separated Discord user IDs allowed to use /diagnostics, in addition to the bot owner
+BOT_ADMIN_IDS = {int(user_id) for user_id in os.getenv("BOT_ADMIN_IDS", "").split(",") if user_id.strip().isdigit()}
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -41,43 +57,711 @@ bot = commands.Bot(command_prefix="!", intents=intents)
 
 # Data storage
 channel_history = {}
-user_quiz_scores = {}
-user_flashcards = {}
-user_study_stats = {}
 active_pomodoro = {}
 flashcard_reviews = {}
+active_views = weakref.WeakSet()
+
+# =============================
+# GEMINI CLIENT POOL
+# =============================
+GEMINI_COOLDOWN = 30  # seconds a key rests after its first 429/5xx, doubling on repeats
+GEMINI_MAX_COOLDOWN = 600
+GEMINI_AUTH_COOLDOWN = 3600  # a revoked or mistyped key won't fix itself soon
+GEMINI_MAX_WAIT = 10  # seconds a request may wait for a resting key before failing
+GEMINI_LATENCY_ALPHA = 0.2  # weight of the newest sample in the latency average
+GEMINI_THREADS_PER_KEY = 4
+GEMINI_MIN_THREADS = min(32, (os.cpu_count() or 1) + 4)  # the default executor's size
+GEMINI_RETRYABLE = (google_exceptions.TooManyRequests, google_exceptions.ServerError)
+GEMINI_AUTH_ERRORS = (google_exceptions.PermissionDenied, google_exceptions.Unauthenticated)
+
+def is_gemini_auth_error(error):
+    # An invalid key comes back as a 400 InvalidArgument, same as a bad request, so check the message
+    if isinstance(error, GEMINI_AUTH_ERRORS):
+        return True
+    return isinstance(error, google_exceptions.InvalidArgument) and "api key" in str(error).lower()
+
+class GeminiKey:
+    """One API key with its own client, rolling quota window and circuit breaker."""
+    def __init__(self, index, api_key, rpm):
+        self.name = f"key-{index + 1}"
+        self.rpm = rpm
+        self.model = genai.GenerativeModel(GEMINI_MODEL)
+        # google-generativeai 0.8.x (pinned in requirements.txt) has no public per-model API key:
+        # GenerativeModel.generate_content uses self._client and only falls back to the global
+        # genai.configure() client while it is None. Re-check this on every SDK upgrade.
+        if not hasattr(self.model, "_client"):
+            raise RuntimeError("google-generativeai no longer exposes GenerativeModel._client; update GeminiKey")
+        self.model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        self.sent = deque()
+        self.in_flight = 0
+        self.latency = 1.0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.probing = False
+        self.total_requests = 0
+        self.total_errors = 0
+
+    def sent_last_minute(self, now):
+        while self.sent and now - self.sent[0] >= 60:
+            self.sent.popleft()
+        return len(self.sent)
+
+    def remaining_quota(self, now):
+        """Requests left under the local cap this minute, or None when no cap is set."""
+        sent = self.sent_last_minute(now)
+        return None if self.rpm is None else self.rpm - sent
+
+    def ready_at(self, now):
+        """When this key can next take a request without expecting a 429."""
+        remaining = self.remaining_quota(now)
+        quota_free = self.sent[0] + 60 if remaining is not None and remaining <= 0 else now
+        ready = max(self.cooldown_until, quota_free)
+        if self.probing:
+            # Half-open: one probe is in flight, everyone else waits for its verdict
+            ready = max(ready, now + self.latency)
+        return ready
+
+    def score(self, now):
+        remaining = self.remaining_quota(now)
+        if remaining is None:
+            # No local cap: favour the key that has been used least recently
+            remaining = 1 / (1 + self.sent_last_minute(now))
+        return remaining / (self.latency * (1 + self.in_flight))
+
+    def record_success(self, elapsed):
+        self.latency += GEMINI_LATENCY_ALPHA * (elapsed - self.latency)
+        self.failures = 0
+
+    def record_failure(self, now, cooldown=None):
+        self.failures += 1
+        self.total_errors += 1
+        if cooldown is None:
+            cooldown = min(GEMINI_COOLDOWN * 2 ** (self.failures - 1), GEMINI_MAX_COOLDOWN)
+        self.cooldown_until = now + cooldown
+
+class GeminiPool:
+    """Spread Gemini requests over several keys, routing around throttled or failing ones."""
+    def __init__(self, api_keys, rpm):
+        self.keys = [GeminiKey(i, api_key, rpm) for i, api_key in enumerate(api_keys)]
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(GEMINI_MIN_THREADS, len(self.keys) * GEMINI_THREADS_PER_KEY)
+        )
+
+    def pick(self, tried):
+        """Return the best ready key, or None; keys in `tried` already failed this request."""
+        now = time.monotonic()
+        ready = [key for key in self.keys if key not in tried and key.ready_at(now) <= now]
+        if not ready:
+            return None
+        return max(ready, key=lambda key: key.score(now))
+
+    def next_ready_at(self, tried):
+        now = time.monotonic()
+        return min((key.ready_at(now) for key in self.keys if key not in tried), default=None)
+
+    async def generate(self, prompt, **kwargs):
+        if not self.keys:
+            raise RuntimeError("No Gemini API keys configured")
+
+        loop = asyncio.get_event_loop()
+        deadline = time.monotonic() + GEMINI_MAX_WAIT
+        tried = set()
+        last_error = None
+        while True:
+            key = self.pick(tried)
+            if key is None:
+                # Every untried key is resting: wait briefly for the first to recover, not hammer it
+                ready_at = self.next_ready_at(tried)
+                if ready_at is None or ready_at > deadline:
+                    raise last_error or RuntimeError("All Gemini API keys are cooling down")
+                await asyncio.sleep(max(0.05, ready_at - time.monotonic()))
+                continue
+
+            # A key that has failed before is half-open: this request is its single probe
+            probe = key.failures > 0
+            key.probing = probe
+            start = time.monotonic()
+            key.sent.append(start)
+            key.in_flight += 1
+            key.total_requests += 1
+            try:
+                response = await loop.run_in_executor(
+                    self.executor, lambda: key.model.generate_content(prompt, **kwargs)
+                )
+            except Exception as e:
+                if is_gemini_auth_error(e):
+                    key.record_failure(time.monotonic(), cooldown=GEMINI_AUTH_COOLDOWN)
+                elif isinstance(e, GEMINI_RETRYABLE):
+                    key.record_failure(time.monotonic())
+                else:
+                    raise
+                log_event("gemini_key_failure", key=key.name, error=type(e).__name__, failures=key.failures)
+                tried.add(key)
+                last_error = e
+                continue
+            finally:
+                key.in_flight -= 1
+                if probe:
+                    key.probing = False
+
+            key.record_success(time.monotonic() - start)
+            return response
+
+    def status(self):
+        now = time.monotonic()
+        return [
+            {
+                "key": key.name,
+                "remaining_rpm": None if key.rpm is None else max(0, key.remaining_quota(now)),
+                "sent_last_min": key.sent_last_minute(now),
+                "latency_s": round(key.latency, 2),
+                "in_flight": key.in_flight,
+                "cooldown_s": round(max(0.0, key.cooldown_until - now), 1),
+                "requests": key.total_requests,
+                "errors": key.total_errors,
+            }
+            for key in self.keys
+        ]
+
+gemini_pool = GeminiPool(GEMINI_API_KEYS, GEMINI_RPM_PER_KEY)
+
+# =============================
+# USER DATA WORKING SET
+# =============================
+USER_DATA_DIR = os.getenv("USER_DATA_DIR", "user_data")
+WORKING_SET_MAX_BYTES = int(os.getenv("WORKING_SET_MAX_MB", "64")) * 1024 * 1024
+WORKING_SET_IDLE_SECONDS = 30 * 60  # evict users idle this long even under the ceiling
+WORKING_SET_MIN_IDLE_SECONDS = 5 * 60  # never evict sooner, so open views keep live objects
+WORKING_SET_SWEEP_SECONDS = 60
+
+class Flashcard:
+    __slots__ = ("question", "answer", "topic", "created", "next_review", "interval", "ease_factor", "reviews")
+
+    def __init__(self, question, answer, topic, created, next_review, interval=1, ease_factor=2.5, reviews=0):
+        self.question = question
+        self.answer = answer
+        self.topic = sys.intern(topic)
+        self.created = created  # unix timestamps
+        self.next_review = next_review
+        self.interval = interval
+        self.ease_factor = ease_factor
+        self.reviews = reviews
+
+    def to_row(self):
+        return [getattr(self, field) for field in self.__slots__]
+
+class QuizScore:
+    __slots__ = ("correct", "total", "topics")
+
+    def __init__(self, correct=0, total=0, topics=None):
+        self.correct = correct
+        self.total = total
+        self.topics = {sys.intern(topic): count for topic, count in (topics or {}).items()}
+
+class StudyStats:
+    __slots__ = ("quizzes", "practice", "pomodoros")
+
+    def __init__(self, quizzes=0, practice=0, pomodoros=0):
+        self.quizzes = quizzes
+        self.practice = practice
+        self.pomodoros = pomodoros
+
+class UserRecord:
+    """Everything we keep per user; quiz and stats stay None until first used."""
+    __slots__ = ("flashcards", "quiz", "stats", "last_active")
+
+    def __init__(self, flashcards=None, quiz=None, stats=None):
+        self.flashcards = flashcards or []
+        self.quiz = quiz
+        self.stats = stats
+        self.last_active = time.time()
+
+    def ensure_quiz(self):
+        if self.quiz is None:
+            self.quiz = QuizScore()
+        return self.quiz
+
+    def ensure_stats(self):
+        if self.stats is None:
+            self.stats = StudyStats()
+        return self.stats
+
+    def estimate_size(self):
+        size = 200
+        for card in self.flashcards:
+            size += 250 + len(card.question) + len(card.answer)
+        if self.quiz is not None:
+            size += 150 + 100 * len(self.quiz.topics)
+        return size
+
+    def encode(self):
+        row = [
+            [card.to_row() for card in self.flashcards],
+            [self.quiz.correct, self.quiz.total, self.quiz.topics] if self.quiz else None,
+            [self.stats.quizzes, self.stats.practice, self.stats.pomodoros] if self.stats else None,
+        ]
+        return zlib.compress(json.dumps(row, separators=(",", ":")).encode("utf-8"))
+
+    @classmethod
+    def decode(cls, data):
+        cards, quiz, stats = json.loads(zlib.decompress(data).decode("utf-8"))
+        return cls(
+            flashcards=[Flashcard(*row) for row in cards],
+            quiz=QuizScore(*quiz) if quiz else None,
+            stats=StudyStats(*stats) if stats else None,
+        )
+
+class WorkingSet:
+    """Keep active users in memory and park idle ones on disk until their next command.
+
+    A user's file exists only while they are evicted: it is deleted as soon as they are loaded back.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.resident = {}
+        self.evicting = {}
+        self.loading = {}
+        self.on_disk = {
+            int(name[:-4]) for name in os.listdir(directory)
+            if name.endswith(".bin") and name[:-4].isdigit()
+        }
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, f"{user_id}.bin")
+
+    def _read(self, user_id):
+        with open(self._path(user_id), "rb") as f:
+            return f.read()
+
+    def _write(self, user_id, record):
+        data = record.encode()
+        path = self._path(user_id)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    async def get(self, user_id, create=True):
+        """Return the user's record, loading it from disk if needed; None if unknown and not create.
+
+        Raises OSError if the user's file can't be read, so the command can report it.
+        """
+        record = self.resident.get(user_id)
+        if record is None:
+            if user_id in self.evicting:
+                record = self.evicting.pop(user_id)
+            elif user_id in self.on_disk:
+                if user_id not in self.loading:
+                    self.loading[user_id] = asyncio.ensure_future(self._load(user_id))
+                try:
+                    # Shielded: the load is shared, and one cancelled caller must not abort it
+                    record = await asyncio.shield(self.loading[user_id])
+                except Exception as e:
+                    # The file stays put, so a later command can try again
+                    log_event("working_set_load_failed", user_id=user_id, error=repr(e))
+                    raise
+            elif create:
+                record = UserRecord()
+            else:
+                return None
+            record = self.resident.setdefault(user_id, record)
+        record.last_active = time.time()
+        return record
+
+    async def _load(self, user_id):
+        loop = asyncio.get_event_loop()
+        path = self._path(user_id)
+        try:
+            try:
+                data = await loop.run_in_executor(None, self._read, user_id)
+            except FileNotFoundError:
+                # Nothing left to load; forget the file so the user can save again
+                log_event("working_set_file_missing", user_id=user_id)
+                self.on_disk.discard(user_id)
+                return self.resident.setdefault(user_id, UserRecord())
+            try:
+                record = UserRecord.decode(data)
+            except Exception as e:
+                # Corrupt file: set it aside for manual recovery and start the user afresh
+                await loop.run_in_executor(None, os.replace, path, path + ".corrupt")
+                self.on_disk.discard(user_id)
+                log_event("working_set_corrupt_file", user_id=user_id, error=repr(e))
+                return self.resident.setdefault(user_id, UserRecord())
+
+            # Only delete the file once its contents are safely back in memory
+            record = self.resident.setdefault(user_id, record)
+            self.on_disk.discard(user_id)
+            try:
+                await loop.run_in_executor(None, os.remove, path)
+            except OSError as e:
+                log_event("working_set_cleanup_failed", user_id=user_id, error=str(e))
+            return record
+        finally:
+            del self.loading[user_id]
+
+    async def _evict(self, user_id, record):
+        self.evicting[user_id] = record
+        loop = asyncio.get_event_loop()
+        try:
+            # Encoding runs in the executor too; zlib and JSON are too slow for the event loop
+            await loop.run_in_executor(None, self._write, user_id, record)
+        except Exception as e:
+            log_event("working_set_write_failed", user_id=user_id, error=repr(e))
+            if self.evicting.pop(user_id, None) is record:
+                self.resident.setdefault(user_id, record)
+            return
+        if self.evicting.get(user_id) is record:
+            del self.evicting[user_id]
+            self.on_disk.add(user_id)
+        else:
+            # The user came back mid-write; their record is resident again, so drop the file
+            try:
+                await loop.run_in_executor(None, os.remove, self._path(user_id))
+            except OSError as e:
+                log_event("working_set_cleanup_failed", user_id=user_id, error=str(e))
+
+    async def sweep(self):
+        """Evict idle users, oldest first, and anyone needed to get back under the memory ceiling."""
+        now = time.time()
+        usage = self.resident_bytes()
+        victims = []
+        for user_id, record in sorted(self.resident.items(), key=lambda item: item[1].last_active):
+            idle_for = now - record.last_active
+            if idle_for < WORKING_SET_MIN_IDLE_SECONDS:
+                break
+            if idle_for < WORKING_SET_IDLE_SECONDS and usage <= WORKING_SET_MAX_BYTES:
+                break
+            usage -= record.estimate_size()
+            victims.append((user_id, record))
+
+        for user_id, _ in victims:
+            del self.resident[user_id]
+        if victims:
+            await asyncio.gather(*(self._evict(user_id, record) for user_id, record in victims))
+            log_event("working_set_evict", users=len(victims), resident=len(self.resident), on_disk=len(self.on_disk))
+
+    def resident_bytes(self):
+        return sum(record.estimate_size() for record in self.resident.values())
+
+    def status(self):
+        return {
+            "resident_users": len(self.resident),
+            "on_disk_users": len(self.on_disk),
+            "estimated_bytes": self.resident_bytes(),
+            "ceiling_bytes": WORKING_SET_MAX_BYTES,
+        }
+
+working_set = WorkingSet(USER_DATA_DIR)
+
+@tasks.loop(seconds=WORKING_SET_SWEEP_SECONDS)
+async def sweep_working_set():
+    await working_set.sweep()
+
+# =============================
+# PROMPT TEMPLATES
+# =============================
+CHARS_PER_TOKEN = 4  # rough English average, good enough for budgeting
+EMBED_DESCRIPTION_LIMIT = 4096
+# gemini-2.5 counts thinking tokens against max_output_tokens and this SDK can't set a thinking
+# budget, so each cap gets this much extra room; the word limit in the prompt bounds visible text
+GEMINI_THINKING_HEADROOM = 1024
+GEMINI_THINKING_RETRY_HEADROOM = 4096  # used once if thinking ate the whole first budget
+
+def estimate_tokens(text):
+    """Cheap local token estimate, so we don't pay a count_tokens round trip per request."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+class GenerationProfile:
+    """Generation settings for one command: output cap, temperature and stop policy."""
+    def __init__(self, max_output_tokens, temperature, stop_sequences=(), json_output=False, max_input_tokens=1500):
+        self.max_output_tokens = max_output_tokens
+        self.temperature = temperature
+        self.stop_sequences = stop_sequences
+        self.json_output = json_output
+        self.max_input_tokens = max_input_tokens
+        self.config = self._make_config(GEMINI_THINKING_HEADROOM)
+        self.retry_config = self._make_config(GEMINI_THINKING_RETRY_HEADROOM)
+
+    def _make_config(self, headroom):
+        return genai.GenerationConfig(
+            max_output_tokens=self.max_output_tokens + headroom,
+            temperature=self.temperature,
+            stop_sequences=list(self.stop_sequences) or None,
+            response_mime_type="application/json" if self.json_output else None,
+        )
+
+    @property
+    def max_words(self):
+        return self.max_output_tokens * 3 // 4
+
+class PromptTemplate:
+    """A prompt whose placeholders are parsed once at startup instead of on every request."""
+    def __init__(self, name, text, profile):
+        self.name = name
+        self.profile = profile
+        self.parts = [
+            (literal, field, spec)
+            for literal, field, spec, _ in string.Formatter().parse(text)
+        ]
+        self.fields = {field for _, field, _ in self.parts if field}
+
+    def render(self, **values):
+        values.setdefault("max_words", self.profile.max_words)
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Prompt '{self.name}' is missing {', '.join(sorted(missing))}")
+
+        values = {field: str(values[field]) for field in self.fields}
+        prompt = self._join(values)
+        # Over budget: trim the longest user-supplied value until the estimate fits
+        excess = estimate_tokens(prompt) - self.profile.max_input_tokens
+        while excess > 0:
+            longest = max(values, key=lambda field: len(values[field]), default=None)
+            if longest is None or not values[longest]:
+                break
+            values[longest] = values[longest][:-excess * CHARS_PER_TOKEN]
+            prompt = self._join(values)
+            excess = estimate_tokens(prompt) - self.profile.max_input_tokens
+        return prompt
+
+    def _join(self, values):
+        pieces = []
+        for literal, field, spec in self.parts:
+            pieces.append(literal)
+            if field:
+                pieces.append(format(values[field], spec))
+        return "".join(pieces)
+
+PROMPT_TEMPLATES = {}
+
+def register_template(name, text, profile):
+    PROMPT_TEMPLATES[name] = PromptTemplate(name, text, profile)
+
+# Long-form answers are capped to roughly what fits in one embed description (~1000 tokens)
+register_template(
+    "solve",
+    "{question}\n\nAnswer clearly in at most {max_words} words.",
+    GenerationProfile(max_output_tokens=900, temperature=0.4),
+)
+register_template(
+    "explain",
+    "Explain '{topic}' step by step for learning purposes, in at most {max_words} words.",
+    GenerationProfile(max_output_tokens=900, temperature=0.5),
+)
+register_template(
+    "define",
+    "Define '{term}' concisely in at most {max_words} words, as a single paragraph without headings.",
+    GenerationProfile(max_output_tokens=150, temperature=0.2, stop_sequences=("\n\n",)),
+)
+register_template(
+    "quiz_multiple_choice",
+    """Generate a {difficulty} multiple-choice question about '{topic}'.{avoid}
+Format your response EXACTLY as JSON:
+{{
+    "question": "the question here",
+    "options": ["option A", "option B", "option C", "option D"],
+    "correct": "the correct option from the list"
+}}""",
+    GenerationProfile(max_output_tokens=250, temperature=0.9, json_output=True),
+)
+register_template(
+    "quiz_true_false",
+    """Generate a {difficulty} true/false question about '{topic}'.{avoid}
+Format as JSON:
+{{
+    "question": "the statement here",
+    "correct": "true" or "false"
+}}""",
+    GenerationProfile(max_output_tokens=150, temperature=0.9, json_output=True),
+)
+register_template(
+    "quiz_fill_blank",
+    """Generate a {difficulty} fill-in-the-blank question about '{topic}'.{avoid}
+Format as JSON:
+{{
+    "question": "the question with ___ for the blank",
+    "answer": "the correct answer for the blank"
+}}""",
+    GenerationProfile(max_output_tokens=150, temperature=0.9, json_output=True),
+)
+register_template(
+    "flashcard",
+    """Create a study flashcard about '{topic}'.
+Format as JSON:
+{{
+    "question": "the question/term",
+    "answer": "detailed answer/definition"
+}}
+Keep the answer under {max_words} words.""",
+    GenerationProfile(max_output_tokens=300, temperature=0.5, json_output=True),
+)
+register_template(
+    "math",
+    "Solve this math problem step by step: {problem}\nShow all work and explain each step clearly, in at most {max_words} words.",
+    GenerationProfile(max_output_tokens=900, temperature=0.1),
+)
+register_template(
+    "science",
+    "Explain this science concept in detail: {question}\nInclude examples and key principles, in at most {max_words} words.",
+    GenerationProfile(max_output_tokens=900, temperature=0.5),
+)
+register_template(
+    "practice",
+    "Create a practice problem for {subject} on the topic of {topic}. Include the problem and a detailed step-by-step solution, in at most {max_words} words.",
+    GenerationProfile(max_output_tokens=900, temperature=0.7),
+)
+register_template(
+    "studytips_subject",
+    "Provide effective study tips and strategies specifically for {subject}, in at most {max_words} words.",
+    GenerationProfile(max_output_tokens=600, temperature=0.7),
+)
+register_template(
+    "studytips_general",
+    "Provide general study tips and strategies for academic success, in at most {max_words} words.",
+    GenerationProfile(max_output_tokens=600, temperature=0.7),
+)
+register_template(
+    "summarize",
+    "Provide a clear, concise summary of: {content}\nHighlight the key points, in at most {max_words} words.",
+    GenerationProfile(max_output_tokens=500, temperature=0.3, max_input_tokens=3000),
+)
+register_template(
+    "compare",
+    "Compare and contrast '{concept1}' and '{concept2}'. Show similarities, differences, and key distinctions, in at most {max_words} words.",
+    GenerationProfile(max_output_tokens=800, temperature=0.4),
+)
 
 # =============================
 # HELPER FUNCTIONS
 # =============================
-async def async_generate(prompt):
-    """Run Gemini API asynchronously."""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, lambda: model.generate_content(prompt))
+async def async_generate(prompt, generation_config=None):
+    """Run Gemini API asynchronously on the healthiest key in the pool."""
+    return await gemini_pool.generate(prompt, generation_config=generation_config)
+
+async def generate_from_template(name, **values):
+    """Render a registered prompt and generate with its command's profile."""
+    template = PROMPT_TEMPLATES[name]
+    prompt = template.render(**values)
+    response = await async_generate(prompt, generation_config=template.profile.config)
+    if not has_response_text(response) and finished_on_max_tokens(response):
+        # Thinking used up the whole cap before any visible text; try once with more room
+        response = await async_generate(prompt, generation_config=template.profile.retry_config)
+    if not has_response_text(response):
+        raise ValueError(f"Gemini returned no text for '{name}'")
+    return response
+
+def has_response_text(response):
+    return any(
+        part.text
+        for candidate in response.candidates[:1]
+        for part in candidate.content.parts
+    )
+
+def finished_on_max_tokens(response):
+    return bool(response.candidates) and (
+        response.candidates[0].finish_reason == genai.protos.Candidate.FinishReason.MAX_TOKENS
+    )
+
+QUIZ_FORMATS = {
+    "Multiple Choice": ("quiz_multiple_choice", "📝 Quiz", ("question", "options", "correct")),
+    "True/False": ("quiz_true_false", "📝 True/False", ("question", "correct")),
+    "Fill in the Blank": ("quiz_fill_blank", "📝 Fill in the Blank", ("question", "answer")),
+}
+QUIZ_MAX_RETRIES = 3
+
+async def generate_quiz_question(quiz_type, topic, difficulty, avoid=()):
+    """Generate one quiz question as a dict, retrying on malformed output or a repeat of `avoid`."""
+    template, _, fields = QUIZ_FORMATS[quiz_type]
+    avoid_text = ""
+    if avoid:
+        avoid_text = "\nDo not repeat any of these questions:\n" + "\n".join(f"- {question}" for question in avoid)
+    seen = {question.strip().lower() for question in avoid}
+    for attempt in range(QUIZ_MAX_RETRIES):
+        try:
+            response = await generate_from_template(
+                template, difficulty=difficulty.lower(), topic=topic, avoid=avoid_text
+            )
+            text = response.text.strip().replace("```json", "").replace("```", "").strip()
+            quiz_data = json.loads(text)
+            
+            if any(field not in quiz_data for field in fields):
+                raise ValueError("Invalid quiz format")
+            if quiz_data["question"].strip().lower() in seen:
+                raise ValueError("Repeated quiz question")
+            return quiz_data
+        except Exception:
+            if attempt == QUIZ_MAX_RETRIES - 1:
+                raise
+
+def make_quiz_embed(quiz_type, topic, difficulty, quiz_data, position=None):
+    _, title, _ = QUIZ_FORMATS[quiz_type]
+    title = f"{title}: {topic} ({difficulty})"
+    if position:
+        title += f" • Q{position[0]}/{position[1]}"
+    
+    text = quiz_data["question"]
+    if quiz_type == "Fill in the Blank":
+        text += "\n\n💡 Type your answer in chat!"
+    return make_embed(title, text, color=0xe67e22)
+
+async def wait_for_typed_answer(ctx, answer):
+    """Wait for the user's typed fill-in-the-blank answer; returns (correct or None on timeout, embed)."""
+    def check(m):
+        return m.author.id == ctx.author.id and m.channel.id == ctx.channel.id
+    
+    try:
+        msg = await bot.wait_for('message', check=check, timeout=60.0)
+    except asyncio.TimeoutError:
+        return None, make_embed("⏰ Time's Up!", f"The correct answer was: **{answer}**", color=0x95a5a6)
+    
+    user_answer = msg.content.strip().lower().replace(".", "").replace(",", "")
+    correct_answer = answer.strip().lower().replace(".", "").replace(",", "")
+    if user_answer == correct_answer:
+        return True, make_embed("✅ Correct!", f"Perfect! The answer is: **{answer}**", color=0x2ecc71)
+    return False, make_embed("❌ Incorrect", f"The correct answer is: **{answer}**", color=0xe74c3c)
 
 def make_embed(title, text, color=0x1abc9c):
     """Return a Discord embed for nicer formatting."""
+    if text and len(text) > EMBED_DESCRIPTION_LIMIT:
+        text = text[:EMBED_DESCRIPTION_LIMIT - 1] + "…"
     embed = discord.Embed(title=title, description=text, color=color)
     return embed
 
-def update_quiz_stats(user_id, topic, correct):
-    if user_id not in user_quiz_scores:
-        user_quiz_scores[user_id] = {"correct": 0, "total": 0, "topics": {}}
+STATS_NOT_SAVED = "⚠️ Your score couldn't be saved. Please try again later."
+USER_DATA_UNAVAILABLE = "⚠️ Could not load your study data. Please try again later."
+
+async def update_quiz_stats(user_id, topic, correct, total=1):
+    """Record one quiz: `correct` answers (a bool for single questions) out of `total`.
+
+    Returns False if the user's data couldn't be loaded, so the caller can tell them.
+    """
+    try:
+        record = await working_set.get(user_id)
+    except OSError:
+        return False
+    scores = record.ensure_quiz()
     if correct:
-        user_quiz_scores[user_id]["correct"] += 1
-        user_quiz_scores[user_id]["topics"][topic] = user_quiz_scores[user_id]["topics"].get(topic, 0) + 1
-    user_quiz_scores[user_id]["total"] += 1
+        scores.correct += correct
+        topic = sys.intern(topic)
+        scores.topics[topic] = scores.topics.get(topic, 0) + correct
+    scores.total += total
     
-    if user_id not in user_study_stats:
-        user_study_stats[user_id] = {"quizzes": 0, "practice": 0, "pomodoros": 0}
-    user_study_stats[user_id]["quizzes"] += 1
+    record.ensure_stats().quizzes += 1
+    return True
+
+class StudyView(View):
+    """Base view that registers itself so diagnostics can count live views."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        active_views.add(self)
 
-class QuizView(View):
-    def __init__(self, correct_answer, options, user_id, topic):
+class QuizView(StudyView):
+    def __init__(self, correct_answer, options, user_id, topic, session=None):
         super().__init__(timeout=60)
         self.correct_answer = correct_answer
         self.user_id = user_id
         self.topic = topic
+        self.session = session
         self.answered = False
         
         for i, option in enumerate(options):
@@ -104,21 +788,31 @@ class QuizView(View):
         selected_answer = self.children[selected_index].label
         
         correct = selected_answer == self.correct_answer
-        update_quiz_stats(self.user_id, self.topic, correct)
         
         if correct:
             embed = make_embed("✅ Correct!", f"Great job! The answer is: **{self.correct_answer}**", color=0x2ecc71)
-            await interaction.response.edit_message(embed=embed, view=None)
         else:
             embed = make_embed("❌ Incorrect", f"The correct answer is: **{self.correct_answer}**", color=0xe74c3c)
-            await interaction.response.edit_message(embed=embed, view=None)
+        
+        if self.session:
+            await self.session.handle_answer(correct, embed, interaction)
+            return
+        
+        if not await update_quiz_stats(self.user_id, self.topic, correct):
+            embed.set_footer(text=STATS_NOT_SAVED)
+        await interaction.response.edit_message(embed=embed, view=None)
+    
+    async def on_timeout(self):
+        if self.session and not self.answered:
+            await self.session.expire(self.message)
 
-class TrueFalseView(View):
-    def __init__(self, correct_answer, user_id, topic):
+class TrueFalseView(StudyView):
+    def __init__(self, correct_answer, user_id, topic, session=None):
         super().__init__(timeout=60)
         self.correct_answer = correct_answer.lower()
         self.user_id = user_id
         self.topic = topic
+        self.session = session
         self.answered = False
     
     @discord.ui.button(label="✅ True", style=discord.ButtonStyle.success, custom_id="true")
@@ -140,16 +834,25 @@ class TrueFalseView(View):
         
         self.answered = True
         correct = answer == self.correct_answer
-        update_quiz_stats(self.user_id, self.topic, correct)
         
         if correct:
             embed = make_embed("✅ Correct!", f"Yes! The answer is **{self.correct_answer.capitalize()}**", color=0x2ecc71)
         else:
             embed = make_embed("❌ Incorrect", f"The correct answer is **{self.correct_answer.capitalize()}**", color=0xe74c3c)
         
+        if self.session:
+            await self.session.handle_answer(correct, embed, interaction)
+            return
+        
+        if not await update_quiz_stats(self.user_id, self.topic, correct):
+            embed.set_footer(text=STATS_NOT_SAVED)
         await interaction.response.edit_message(embed=embed, view=None)
+    
+    async def on_timeout(self):
+        if self.session and not self.answered:
+            await self.session.expire(self.message)
 
-class FlashcardView(View):
+class FlashcardView(StudyView):
     def __init__(self, question, answer, user_id, card_data=None, is_review=False):
         super().__init__(timeout=120)
         self.question = question
@@ -205,31 +908,36 @@ class FlashcardView(View):
         if not self.card_data:
             return
         
-        now = datetime.now()
-        self.card_data["reviews"] += 1
+        try:
+            await working_set.get(self.user_id)
+        except OSError:
+            await interaction.response.send_message(USER_DATA_UNAVAILABLE, ephemeral=True)
+            return
+        card = self.card_data
+        card.reviews += 1
         
         if difficulty == "easy":
-            self.card_data["interval"] = min(self.card_data["interval"] * 2.5, 30)
-            self.card_data["ease_factor"] = min(self.card_data["ease_factor"] + 0.15, 3.0)
+            card.interval = min(card.interval * 2.5, 30)
+            card.ease_factor = min(card.ease_factor + 0.15, 3.0)
             feedback = "Great! This card will appear in a longer interval."
         elif difficulty == "good":
-            self.card_data["interval"] = min(self.card_data["interval"] * 2, 30)
+            card.interval = min(card.interval * 2, 30)
             feedback = "Good! Standard interval applied."
         else:
-            self.card_data["interval"] = max(1, self.card_data["interval"] * 0.5)
-            self.card_data["ease_factor"] = max(self.card_data["ease_factor"] - 0.2, 1.3)
+            card.interval = max(1, card.interval * 0.5)
+            card.ease_factor = max(card.ease_factor - 0.2, 1.3)
             feedback = "I'll show this card again soon."
         
-        self.card_data["next_review"] = (now + timedelta(days=int(self.card_data["interval"]))).isoformat()
+        card.next_review = time.time() + int(card.interval) * 86400
         
         result_embed = make_embed(
             "✅ Review Complete",
-            f"{feedback}\nNext review: {int(self.card_data['interval'])} days",
+            f"{feedback}\nNext review: {int(card.interval)} days",
             color=0x2ecc71
         )
         await interaction.response.edit_message(embed=result_embed, view=None)
 
-class PomodoroView(View):
+class PomodoroView(StudyView):
     def __init__(self, user_id, duration=25):
         super().__init__(timeout=duration * 60 + 10)
         self.user_id = user_id
@@ -257,12 +965,387 @@ class PomodoroView(View):
         embed = make_embed("⏹️ Timer Stopped", "Your study session has been stopped.", color=0xe74c3c)
         await interaction.response.edit_message(embed=embed, view=None)
 
+class NextQuestionView(StudyView):
+    def __init__(self, session):
+        super().__init__(timeout=120)
+        self.session = session
+        self.clicked = False
+
+    @discord.ui.button(label="➡️ Next Question", style=discord.ButtonStyle.primary)
+    async def next_button(self, button: Button, interaction: discord.Interaction):
+        if interaction.user.id != self.session.user_id:
+            await interaction.response.send_message("This quiz is not for you!", ephemeral=True)
+            return
+
+        if self.clicked:
+            await interaction.response.send_message("The next question is already on its way!", ephemeral=True)
+            return
+
+        self.clicked = True
+        self.stop()
+        await self.session.next_question(interaction)
+
+    async def on_timeout(self):
+        await self.session.expire(self.message)
+
+# =============================
+# QUIZ SESSIONS
+# =============================
+QUIZ_SESSION_MAX_QUESTIONS = 20
+
+class QuizSession:
+    """A multi-question quiz that generates question k+1 while the user answers question k."""
+    def __init__(self, ctx, topic, quiz_type, difficulty, total):
+        self.ctx = ctx
+        self.user_id = ctx.author.id
+        self.topic = topic
+        self.quiz_type = quiz_type
+        self.difficulty = difficulty
+        self.total = total
+        self.asked = 0
+        self.answered = 0
+        self.score = 0
+        self.questions = []
+        self.embed = None  # the embed last shown, restored with the score if the session times out
+        self.prefetch = None
+        self.finished = False
+        self.save_failed = False
+
+    def _prefetch_next(self):
+        if self.asked < self.total:
+            self.prefetch = asyncio.ensure_future(
+                generate_quiz_question(self.quiz_type, self.topic, self.difficulty, avoid=tuple(self.questions))
+            )
+        else:
+            self.prefetch = None
+
+    def _question_message(self, quiz_data):
+        """Count the question as asked, queue the next one, and build its embed and view."""
+        self.asked += 1
+        self.questions.append(quiz_data["question"])
+        self._prefetch_next()
+
+        embed = make_quiz_embed(self.quiz_type, self.topic, self.difficulty, quiz_data, position=(self.asked, self.total))
+        embed.set_footer(text=f"Score: {self.score}/{self.answered}")
+        self.embed = embed
+        if self.quiz_type == "Multiple Choice":
+            view = QuizView(quiz_data["correct"], quiz_data["options"], self.user_id, self.topic, session=self)
+        elif self.quiz_type == "True/False":
+            view = TrueFalseView(quiz_data["correct"], self.user_id, self.topic, session=self)
+        else:
+            view = None
+        return embed, view
+
+    async def start(self):
+        try:
+            quiz_data = await generate_quiz_question(self.quiz_type, self.topic, self.difficulty)
+        except Exception:
+            await self.ctx.followup.send("⚠️ Could not generate quiz. Please try again.")
+            return
+
+        embed, view = self._question_message(quiz_data)
+        if view:
+            await self.ctx.followup.send(embed=embed, view=view)
+        else:
+            await self.ctx.followup.send(embed=embed)
+            await self._collect_typed_answer(quiz_data)
+
+    async def next_question(self, interaction):
+        task = self.prefetch
+        if task.done():
+            edit = interaction.response.edit_message
+        else:
+            # Only happens if the user answered faster than Gemini could generate
+            waiting = make_embed("🧠 Generating next question...", "Almost there!", color=0xe67e22)
+            await interaction.response.edit_message(embed=waiting, view=None)
+            edit = interaction.edit_original_response
+
+        try:
+            quiz_data = await task
+        except Exception:
+            await self.finish()
+            embed = make_embed("⚠️ Could not generate the next question", self.summary(), color=0xe74c3c)
+            await edit(embed=embed, view=None)
+            return
+
+        embed, view = self._question_message(quiz_data)
+        await edit(embed=embed, view=view)
+        if view is None:
+            await self._collect_typed_answer(quiz_data)
+
+    async def _collect_typed_answer(self, quiz_data):
+        correct, embed = await wait_for_typed_answer(self.ctx, quiz_data["answer"])
+        if correct is None:
+            # An unanswered question ends the session, as it does for the button types
+            await self.finish()
+            embed.add_field(name="🏁 Quiz Over", value=self.summary(), inline=False)
+            await self.ctx.send(embed=embed)
+            return
+        await self.handle_answer(correct, embed)
+
+    async def handle_answer(self, correct, embed, interaction=None):
+        self.answered += 1
+        self.score += int(correct)
+
+        if self.answered >= self.total:
+            await self.finish()
+            embed.add_field(name="🏁 Quiz Complete", value=self.summary(), inline=False)
+            view = None
+        else:
+            embed.set_footer(text=f"Score: {self.score}/{self.answered} • Question {self.answered}/{self.total}")
+            view = NextQuestionView(self)
+        self.embed = embed
+
+        if interaction:
+            await interaction.response.edit_message(embed=embed, view=view)
+        elif view:
+            await self.ctx.send(embed=embed, view=view)
+        else:
+            await self.ctx.send(embed=embed)
+
+    async def finish(self):
+        """End the session and record it as a single quiz in the user's stats."""
+        if self.finished:
+            return
+        self.finished = True
+        if self.prefetch and not self.prefetch.done():
+            self.prefetch.cancel()
+        elif self.prefetch and not self.prefetch.cancelled():
+            self.prefetch.exception()  # mark a failed, unused prefetch as handled
+        if self.answered:
+            self.save_failed = not await update_quiz_stats(self.user_id, self.topic, self.score, self.answered)
+
+    async def expire(self, message):
+        """End the session after a question went unanswered and show the score in place of its buttons."""
+        await self.finish()
+        if message is None:
+            return
+        # Not message.embeds: after edit_message, py-cord's view.message is the message as it was before the edit
+        embed = self.embed or make_embed("📝 Quiz", None)
+        embed.add_field(name="⏰ Time's Up — Quiz Over", value=self.summary(), inline=False)
+        try:
+            await message.edit(embed=embed, view=None)
+        except discord.HTTPException:
+            pass
+
+    def summary(self):
+        if not self.answered:
+            return "No questions answered."
+        accuracy = self.score / self.answered * 100
+        summary = f"You scored **{self.score}/{self.answered}** ({accuracy:.0f}%)"
+        if self.save_failed:
+            summary += f"\n{STATS_NOT_SAVED}"
+        return summary
+
+# =============================
+# DIAGNOSTICS
+# =============================
+LOOP_LAG_INTERVAL = 0.5  # seconds between event-loop heartbeats
+LOOP_LAG_WARNING = 0.1
+LOOP_LAG_CRITICAL = 1.0
+SLOW_CALLBACK_THRESHOLD = 0.25  # seconds the loop may block before its stack is captured
+LOOP_HEARTBEAT_INTERVAL = SLOW_CALLBACK_THRESHOLD / 4  # well below the threshold so short blocks are seen
+DIAGNOSTICS_LOG_MINUTES = 5
+TRACEMALLOC_FRAMES = 5
+TRACEMALLOC_MAX_SECONDS = 15 * 60  # tracing slows every allocation, so it switches itself off
+DIAGNOSTICS_SAMPLE_SIZE = 1000  # entries per store deep-walked for size estimates
+
+loop_lag_stats = {"last": 0.0, "max": 0.0, "warnings": 0, "critical": 0, "recent": deque(maxlen=120)}
+loop_heartbeat = {"time": None, "thread_id": None}
+slow_callbacks = deque(maxlen=10)
+last_memory_snapshot = None
+tracemalloc_stop_handle = None
+diagnostics_started = False
+
+def log_event(event, **fields):
+    """Print a single-line JSON log record."""
+    print(json.dumps({"event": event, "time": datetime.now().isoformat(), **fields}, default=str))
+
+def loop_heartbeat_tick(loop):
+    """Stamp the heartbeat the watchdog thread reads, then reschedule."""
+    loop_heartbeat["time"] = time.monotonic()
+    loop.call_later(LOOP_HEARTBEAT_INTERVAL, loop_heartbeat_tick, loop)
+
+async def monitor_loop_lag():
+    """Measure how late the event loop wakes up from a fixed sleep."""
+    loop = asyncio.get_event_loop()
+    loop_heartbeat["thread_id"] = get_ident()
+    loop_heartbeat_tick(loop)
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - start - LOOP_LAG_INTERVAL)
+
+        loop_lag_stats["last"] = lag
+        loop_lag_stats["max"] = max(loop_lag_stats["max"], lag)
+        loop_lag_stats["recent"].append(lag)
+        if lag >= LOOP_LAG_CRITICAL:
+            loop_lag_stats["critical"] += 1
+            log_event("loop_lag", level="critical", lag_seconds=round(lag, 3))
+        elif lag >= LOOP_LAG_WARNING:
+            loop_lag_stats["warnings"] += 1
+            log_event("loop_lag", level="warning", lag_seconds=round(lag, 3))
+
+def watch_for_slow_callbacks():
+    """Watchdog thread: capture the event loop's stack while it is blocked."""
+    captured = None
+    while True:
+        # Poll faster than the heartbeat so a block just over the threshold is still caught
+        time.sleep(LOOP_HEARTBEAT_INTERVAL / 2)
+        beat = loop_heartbeat["time"]
+        if beat is None or beat == captured:
+            continue
+        blocked = time.monotonic() - beat
+        if blocked < SLOW_CALLBACK_THRESHOLD:
+            continue
+        frame = sys._current_frames().get(loop_heartbeat["thread_id"])
+        if frame is None:
+            continue
+
+        captured = beat
+        stack = "".join(traceback.format_stack(frame)[-8:])
+        slow_callbacks.append({"time": datetime.now(), "blocked": blocked, "stack": stack})
+        log_event("slow_callback", blocked_seconds=round(blocked, 3), stack=stack)
+
+def loop_lag_summary():
+    recent = loop_lag_stats["recent"]
+    return {
+        "last_ms": round(loop_lag_stats["last"] * 1000, 1),
+        "avg_ms": round(sum(recent) / len(recent) * 1000, 1) if recent else 0.0,
+        "max_ms": round(loop_lag_stats["max"] * 1000, 1),
+        "warnings": loop_lag_stats["warnings"],
+        "critical": loop_lag_stats["critical"],
+    }
+
+def deep_sizeof(obj, seen=None):
+    """Approximate the bytes held by obj, following nested containers."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(type(obj), "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, slot), seen) for slot in type(obj).__slots__ if hasattr(obj, slot))
+    return size
+
+async def estimate_store_bytes(items):
+    """Deep-size a sample of (key, value) items and extrapolate, yielding to the loop as we go."""
+    if not items:
+        return 0
+    sample = items if len(items) <= DIAGNOSTICS_SAMPLE_SIZE else random.sample(items, DIAGNOSTICS_SAMPLE_SIZE)
+    seen = set()
+    total = 0
+    for i, (key, value) in enumerate(sample, 1):
+        total += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    return int(total * len(items) / len(sample))
+
+async def memory_report():
+    """Per-store memory accounting for user data, channel dicts, views and waiters."""
+    stores = {
+        "working_set": working_set.resident,
+        "channel_history": channel_history,
+        "active_pomodoro": active_pomodoro,
+    }
+    report = {}
+    for name, store in stores.items():
+        items = list(store.items())
+        report[name] = {
+            "keys": len(items),
+            "items": sum(len(v.flashcards if isinstance(v, UserRecord) else v) for _, v in items if isinstance(v, (list, dict, UserRecord))),
+            "bytes": await estimate_store_bytes(items),
+        }
+    report["evicted_users"] = {"keys": len(working_set.on_disk), "items": len(working_set.loading), "bytes": 0}
+
+    live_views = [view for view in active_views if not view.is_finished()]
+    report["active_views"] = {"keys": len(live_views), "items": sum(len(v.children) for v in live_views), "bytes": 0}
+    waiters = getattr(bot, "_listeners", None) or {}
+    report["pending_waiters"] = {"keys": len(waiters), "items": sum(len(w) for w in waiters.values()), "bytes": 0}
+    return report
+
+def stop_memory_tracing():
+    global last_memory_snapshot, tracemalloc_stop_handle
+    if tracemalloc_stop_handle is not None:
+        tracemalloc_stop_handle.cancel()
+        tracemalloc_stop_handle = None
+    tracemalloc.stop()
+    last_memory_snapshot = None
+
+def _take_memory_snapshot(limit, previous):
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    top = snapshot.statistics("lineno")[:limit]
+    growth = []
+    if previous is not None:
+        growth = [stat for stat in snapshot.compare_to(previous, "lineno") if stat.size_diff > 0][:limit]
+    return snapshot, top, growth
+
+async def tracemalloc_report(limit):
+    """Return (top allocations, growth since the previous snapshot), starting tracing if needed."""
+    global last_memory_snapshot, tracemalloc_stop_handle
+    loop = asyncio.get_event_loop()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc_stop_handle = loop.call_later(TRACEMALLOC_MAX_SECONDS, stop_memory_tracing)
+
+    # Snapshot and diff off the event loop; they walk every traced allocation
+    snapshot, top, growth = await loop.run_in_executor(None, _take_memory_snapshot, limit, last_memory_snapshot)
+    last_memory_snapshot = snapshot
+    return top, growth
+
+def _format_bytes(size):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+def _format_stat_line(stat, size):
+    frame = stat.traceback[0]
+    return f"`{os.path.basename(frame.filename)}:{frame.lineno}` {_format_bytes(size)}"
+
+@tasks.loop(minutes=DIAGNOSTICS_LOG_MINUTES)
+async def log_diagnostics():
+    log_event(
+        "diagnostics",
+        loop_lag=loop_lag_summary(),
+        memory=await memory_report(),
+        working_set=working_set.status(),
+        gemini=gemini_pool.status()
+    )
+
+def start_diagnostics():
+    global diagnostics_started
+    if diagnostics_started:
+        return
+    diagnostics_started = True
+    asyncio.get_event_loop().create_task(monitor_loop_lag())
+    Thread(target=watch_for_slow_callbacks, daemon=True).start()
+    log_diagnostics.start()
+
+async def is_bot_admin(ctx):
+    """Diagnostics span every guild, so only the bot owner and BOT_ADMIN_IDS may see them."""
+    return ctx.author.id in BOT_ADMIN_IDS or await bot.is_owner(ctx.author)
+
 # =============================
 # EVENTS
 # =============================
 @bot.event
 async def on_ready():
     print(f"🤖 Logged in as {bot.user}")
+    start_diagnostics()
+    start_math_pool()
+    if not sweep_working_set.is_running():
+        sweep_working_set.start()
     await bot.change_presence(activity=discord.Game("Supreme Study Bot 📚 | /help for commands"))
 
 # =============================
@@ -272,7 +1355,7 @@ async def on_ready():
 async def solve(ctx, question: Option(str, "Type your question here")):
     await ctx.respond("🧠 Thinking...")
     try:
-        response = await async_generate(question)
+        response = await generate_from_template("solve", question=question)
         embed = make_embed("📘 Answer", response.text)
         await ctx.send_followup(embed=embed)
 
@@ -288,8 +1371,7 @@ async def solve(ctx, question: Option(str, "Type your question here")):
 async def explain(ctx, topic: Option(str, "Topic you want explained")):
     await ctx.respond("🧠 Explaining...")
     try:
-        prompt = f"Explain '{topic}' step by step for learning purposes."
-        response = await async_generate(prompt)
+        response = await generate_from_template("explain", topic=topic)
         embed = make_embed("📝 Explanation", response.text, color=0xf1c40f)
         await ctx.send_followup(embed=embed)
     except Exception:
@@ -299,8 +1381,7 @@ async def explain(ctx, topic: Option(str, "Topic you want explained")):
 async def define(ctx, term: Option(str, "Term you want defined")):
     await ctx.respond("🧠 Searching definition...")
     try:
-        prompt = f"Define '{term}' concisely."
-        response = await async_generate(prompt)
+        response = await generate_from_template("define", term=term)
         embed = make_embed("📚 Definition", response.text, color=0x3498db)
         await ctx.send_followup(embed=embed)
     except Exception:
@@ -322,146 +1403,57 @@ async def quiz(
     ctx, 
     topic: Option(str, "Topic for the quiz"), 
     quiz_type: Option(str, "Question type", choices=["Multiple Choice", "True/False", "Fill in the Blank"]) = "Multiple Choice",
-    difficulty: Option(str, "Difficulty level", choices=["Easy", "Medium", "Hard"]) = "Medium"
+    difficulty: Option(str, "Difficulty level", choices=["Easy", "Medium", "Hard"]) = "Medium",
+    questions: Option(int, "Number of questions (more than 1 starts a quiz session)", min_value=1, max_value=QUIZ_SESSION_MAX_QUESTIONS) = 1
 ):
     await ctx.defer()
     
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            if quiz_type == "Multiple Choice":
-                prompt = f"""Generate a {difficulty.lower()} multiple-choice question about '{topic}'.
-Format your response EXACTLY as JSON:
-{{
-    "question": "the question here",
-    "options": ["option A", "option B", "option C", "option D"],
-    "correct": "the correct option from the list"
-}}"""
-                
-                response = await async_generate(prompt)
-                text = response.text.strip().replace("```json", "").replace("```", "").strip()
-                quiz_data = json.loads(text)
-                
-                if "question" not in quiz_data or "options" not in quiz_data or "correct" not in quiz_data:
-                    raise ValueError("Invalid quiz format")
-                
-                embed = make_embed(
-                    f"📝 Quiz: {topic} ({difficulty})",
-                    quiz_data["question"],
-                    color=0xe67e22
-                )
-                view = QuizView(quiz_data["correct"], quiz_data["options"], ctx.author.id, topic)
-                await ctx.followup.send(embed=embed, view=view)
-                return
-                
-            elif quiz_type == "True/False":
-                prompt = f"""Generate a {difficulty.lower()} true/false question about '{topic}'.
-Format as JSON:
-{{
-    "question": "the statement here",
-    "correct": "true" or "false"
-}}"""
-                
-                response = await async_generate(prompt)
-                text = response.text.strip().replace("```json", "").replace("```", "").strip()
-                quiz_data = json.loads(text)
-                
-                if "question" not in quiz_data or "correct" not in quiz_data:
-                    raise ValueError("Invalid quiz format")
-                
-                embed = make_embed(
-                    f"📝 True/False: {topic} ({difficulty})",
-                    quiz_data["question"],
-                    color=0xe67e22
-                )
-                view = TrueFalseView(quiz_data["correct"], ctx.author.id, topic)
-                await ctx.followup.send(embed=embed, view=view)
-                return
-                
-            else:
-                prompt = f"""Generate a {difficulty.lower()} fill-in-the-blank question about '{topic}'.
-Format as JSON:
-{{
-    "question": "the question with ___ for the blank",
-    "answer": "the correct answer for the blank"
-}}"""
-                
-                response = await async_generate(prompt)
-                text = response.text.strip().replace("```json", "").replace("```", "").strip()
-                quiz_data = json.loads(text)
-                
-                if "question" not in quiz_data or "answer" not in quiz_data:
-                    raise ValueError("Invalid quiz format")
-                
-                embed = make_embed(
-                    f"📝 Fill in the Blank: {topic} ({difficulty})",
-                    f"{quiz_data['question']}\n\n💡 Type your answer in chat!",
-                    color=0xe67e22
-                )
-                await ctx.followup.send(embed=embed)
-                
-                def check(m):
-                    return m.author.id == ctx.author.id and m.channel.id == ctx.channel.id
-                
-                try:
-                    msg = await bot.wait_for('message', check=check, timeout=60.0)
-                    user_answer = msg.content.strip().lower().replace(".", "").replace(",", "")
-                    correct_answer = quiz_data["answer"].strip().lower().replace(".", "").replace(",", "")
-                    
-                    correct = user_answer == correct_answer
-                    update_quiz_stats(ctx.author.id, topic, correct)
-                    
-                    if correct:
-                        result_embed = make_embed("✅ Correct!", f"Perfect! The answer is: **{quiz_data['answer']}**", color=0x2ecc71)
-                    else:
-                        result_embed = make_embed("❌ Incorrect", f"The correct answer is: **{quiz_data['answer']}**", color=0xe74c3c)
-                    
-                    await ctx.send(embed=result_embed)
-                    return
-                except asyncio.TimeoutError:
-                    timeout_embed = make_embed("⏰ Time's Up!", f"The correct answer was: **{quiz_data['answer']}**", color=0x95a5a6)
-                    await ctx.send(embed=timeout_embed)
-                    return
-            
-        except (json.JSONDecodeError, ValueError, KeyError) as e:
-            if attempt < max_retries - 1:
-                continue
-            await ctx.followup.send("⚠️ Error generating quiz. Please try again.")
-            return
-        except Exception as e:
-            if attempt < max_retries - 1:
-                continue
-            await ctx.followup.send("⚠️ Could not generate quiz. Please try again.")
-            return
+    if questions > 1:
+        await QuizSession(ctx, topic, quiz_type, difficulty, questions).start()
+        return
+    
+    try:
+        quiz_data = await generate_quiz_question(quiz_type, topic, difficulty)
+    except (json.JSONDecodeError, ValueError, KeyError):
+        await ctx.followup.send("⚠️ Error generating quiz. Please try again.")
+        return
+    except Exception:
+        await ctx.followup.send("⚠️ Could not generate quiz. Please try again.")
+        return
+    
+    embed = make_quiz_embed(quiz_type, topic, difficulty, quiz_data)
+    if quiz_type == "Multiple Choice":
+        view = QuizView(quiz_data["correct"], quiz_data["options"], ctx.author.id, topic)
+        await ctx.followup.send(embed=embed, view=view)
+        return
+    
+    if quiz_type == "True/False":
+        view = TrueFalseView(quiz_data["correct"], ctx.author.id, topic)
+        await ctx.followup.send(embed=embed, view=view)
+        return
+    
+    await ctx.followup.send(embed=embed)
+    correct, result_embed = await wait_for_typed_answer(ctx, quiz_data["answer"])
+    if correct is not None and not await update_quiz_stats(ctx.author.id, topic, correct):
+        result_embed.set_footer(text=STATS_NOT_SAVED)
+    await ctx.send(embed=result_embed)
 
 @bot.slash_command(description="Create flashcards for studying")
 async def flashcard(ctx, topic: Option(str, "Topic for flashcards")):
     await ctx.defer()
     try:
-        prompt = f"""Create a study flashcard about '{topic}'.
-Format as JSON:
-{{
-    "question": "the question/term",
-    "answer": "detailed answer/definition"
-}}"""
-        
-        response = await async_generate(prompt)
+        response = await generate_from_template("flashcard", topic=topic)
         card_data = json.loads(response.text.strip().replace("```json", "").replace("```", "").strip())
         
-        if ctx.author.id not in user_flashcards:
-            user_flashcards[ctx.author.id] = []
-        
-        card_with_meta = {
-            "question": card_data["question"],
-            "answer": card_data["answer"],
-            "topic": topic,
-            "created": datetime.now().isoformat(),
-            "next_review": (datetime.now() + timedelta(days=1)).isoformat(),
-            "interval": 1,
-            "ease_factor": 2.5,
-            "reviews": 0
-        }
-        user_flashcards[ctx.author.id].append(card_with_meta)
+        record = await working_set.get(ctx.author.id)
+        now = time.time()
+        record.flashcards.append(Flashcard(
+            question=card_data["question"],
+            answer=card_data["answer"],
+            topic=topic,
+            created=now,
+            next_review=now + 86400
+        ))
         
         embed = make_embed("🎴 Flashcard Created", card_data["question"], color=0x9b59b6)
         view = FlashcardView(card_data["question"], card_data["answer"], ctx.author.id)
@@ -474,20 +1466,22 @@ Format as JSON:
 async def review(ctx):
     user_id = ctx.author.id
     
-    if user_id not in user_flashcards or not user_flashcards[user_id]:
+    try:
+        record = await working_set.get(user_id, create=False)
+    except OSError:
+        await ctx.respond(USER_DATA_UNAVAILABLE, ephemeral=True)
+        return
+    
+    if record is None or not record.flashcards:
         await ctx.respond("📭 No flashcards to review. Create some with `/flashcard`!")
         return
     
-    now = datetime.now()
-    due_cards = [card for card in user_flashcards[user_id] 
-                 if datetime.fromisoformat(card["next_review"]) <= now]
+    now = time.time()
+    due_cards = [card for card in record.flashcards if card.next_review <= now]
     
     if not due_cards:
-        next_review = min(user_flashcards[user_id], 
-                         key=lambda x: datetime.fromisoformat(x["next_review"]))
-        next_time = datetime.fromisoformat(next_review["next_review"])
-        time_until = next_time - now
-        hours = int(time_until.total_seconds() / 3600)
+        next_time = min(card.next_review for card in record.flashcards)
+        hours = int((next_time - now) / 3600)
         
         embed = make_embed(
             "✅ All Caught Up!",
@@ -500,18 +1494,26 @@ async def review(ctx):
     card = random.choice(due_cards)
     embed = make_embed(
         f"🎴 Review ({len(due_cards)} cards due)",
-        card["question"],
+        card.question,
         color=0x9b59b6
     )
-    view = FlashcardView(card["question"], card["answer"], user_id, card_data=card, is_review=True)
+    view = FlashcardView(card.question, card.answer, user_id, card_data=card, is_review=True)
     await ctx.respond(embed=embed, view=view)
 
 @bot.slash_command(description="Get help with math problems")
 async def math(ctx, problem: Option(str, "Your math problem")):
     await ctx.defer()
+
+    # Plain arithmetic, equations, derivatives and integrals never need the network
+    solution = await async_solve_math(problem)
+    if solution:
+        embed = make_embed("🔢 Math Solution", solution, color=0x3498db)
+        embed.set_footer(text="⚡ Solved instantly by the local math engine")
+        await ctx.followup.send(embed=embed)
+        return
+
     try:
-        prompt = f"Solve this math problem step by step: {problem}\nShow all work and explain each step clearly."
-        response = await async_generate(prompt)
+        response = await generate_from_template("math", problem=problem)
         embed = make_embed("🔢 Math Solution", response.text, color=0x3498db)
         await ctx.followup.send(embed=embed)
     except Exception:
@@ -521,8 +1523,7 @@ async def math(ctx, problem: Option(str, "Your math problem")):
 async def science(ctx, question: Option(str, "Your science question")):
     await ctx.defer()
     try:
-        prompt = f"Explain this science concept in detail: {question}\nInclude examples and key principles."
-        response = await async_generate(prompt)
+        response = await generate_from_template("science", question=question)
         embed = make_embed("🔬 Science Explanation", response.text, color=0x1abc9c)
         await ctx.followup.send(embed=embed)
     except Exception:
@@ -532,14 +1533,12 @@ async def science(ctx, question: Option(str, "Your science question")):
 async def practice(ctx, subject: Option(str, "Subject"), topic: Option(str, "Specific topic")):
     await ctx.defer()
     try:
-        prompt = f"Create a practice problem for {subject} on the topic of {topic}. Include the problem and a detailed step-by-step solution."
-        response = await async_generate(prompt)
+        response = await generate_from_template("practice", subject=subject, topic=topic)
+        record = await working_set.get(ctx.author.id)
+        record.ensure_stats().practice += 1
+        
         embed = make_embed(f"📚 Practice: {subject}", response.text, color=0xf39c12)
         await ctx.followup.send(embed=embed)
-        
-        if ctx.author.id not in user_study_stats:
-            user_study_stats[ctx.author.id] = {"quizzes": 0, "practice": 0, "pomodoros": 0}
-        user_study_stats[ctx.author.id]["practice"] += 1
     except Exception:
         await ctx.followup.send("⚠️ Could not generate practice problem.")
 
@@ -563,20 +1562,26 @@ async def pomodoro(ctx, minutes: Option(int, "Study duration in minutes", min_va
     if ctx.author.id in active_pomodoro:
         del active_pomodoro[ctx.author.id]
         
-        if ctx.author.id not in user_study_stats:
-            user_study_stats[ctx.author.id] = {"quizzes": 0, "practice": 0, "pomodoros": 0}
-        user_study_stats[ctx.author.id]["pomodoros"] += 1
-        
         completion_embed = make_embed(
             "✅ Timer Complete!",
             f"Great work! You studied for {minutes} minutes.\nTime for a break! 🎉",
             color=0x2ecc71
         )
+        try:
+            record = await working_set.get(ctx.author.id)
+            record.ensure_stats().pomodoros += 1
+        except OSError:
+            completion_embed.set_footer(text="⚠️ This session couldn't be added to your stats.")
         await ctx.send(f"<@{ctx.author.id}>", embed=completion_embed)
 
 @bot.slash_command(description="View your study statistics")
 async def stats(ctx):
     user_id = ctx.author.id
+    try:
+        record = await working_set.get(user_id, create=False) or UserRecord()
+    except OSError:
+        await ctx.respond(USER_DATA_UNAVAILABLE, ephemeral=True)
+        return
     
     embed = discord.Embed(
         title=f"📊 Study Stats for {ctx.author.name}",
@@ -584,35 +1589,35 @@ async def stats(ctx):
         color=0x3498db
     )
     
-    if user_id in user_quiz_scores:
-        scores = user_quiz_scores[user_id]
-        accuracy = (scores["correct"] / scores["total"] * 100) if scores["total"] > 0 else 0
+    if record.quiz is not None:
+        scores = record.quiz
+        accuracy = (scores.correct / scores.total * 100) if scores.total > 0 else 0
         embed.add_field(
             name="📝 Quiz Performance",
-            value=f"✅ Correct: {scores['correct']}\n❌ Total Attempted: {scores['total']}\n📈 Accuracy: {accuracy:.1f}%",
+            value=f"✅ Correct: {scores.correct}\n❌ Total Attempted: {scores.total}\n📈 Accuracy: {accuracy:.1f}%",
             inline=True
         )
         
-        if scores["topics"]:
-            top_topics = sorted(scores["topics"].items(), key=lambda x: x[1], reverse=True)[:3]
+        if scores.topics:
+            top_topics = sorted(scores.topics.items(), key=lambda x: x[1], reverse=True)[:3]
             topics_text = "\n".join([f"• {topic}: {count}" for topic, count in top_topics])
             embed.add_field(name="🏆 Top Topics", value=topics_text, inline=True)
     else:
         embed.add_field(name="📝 Quiz Performance", value="No data yet", inline=True)
     
-    if user_id in user_study_stats:
-        stats = user_study_stats[user_id]
+    if record.stats is not None:
+        stats = record.stats
         embed.add_field(
             name="📚 Study Activities",
-            value=f"🎯 Quizzes: {stats.get('quizzes', 0)}\n📖 Practice: {stats.get('practice', 0)}\n⏰ Pomodoros: {stats.get('pomodoros', 0)}",
+            value=f"🎯 Quizzes: {stats.quizzes}\n📖 Practice: {stats.practice}\n⏰ Pomodoros: {stats.pomodoros}",
             inline=True
         )
     
-    if user_id in user_flashcards and user_flashcards[user_id]:
-        cards = user_flashcards[user_id]
-        now = datetime.now()
-        due_count = sum(1 for card in cards if datetime.fromisoformat(card["next_review"]) <= now)
-        total_reviews = sum(card.get("reviews", 0) for card in cards)
+    if record.flashcards:
+        cards = record.flashcards
+        now = time.time()
+        due_count = sum(1 for card in cards if card.next_review <= now)
+        total_reviews = sum(card.reviews for card in cards)
         
         embed.add_field(
             name="🎴 Flashcards",
@@ -621,10 +1626,10 @@ async def stats(ctx):
         )
     
     total_activities = (
-        user_quiz_scores.get(user_id, {}).get("total", 0) +
-        user_study_stats.get(user_id, {}).get("practice", 0) +
-        user_study_stats.get(user_id, {}).get("pomodoros", 0) +
-        len(user_flashcards.get(user_id, []))
+        (record.quiz.total if record.quiz else 0) +
+        (record.stats.practice if record.stats else 0) +
+        (record.stats.pomodoros if record.stats else 0) +
+        len(record.flashcards)
     )
     
     embed.set_footer(text=f"Total Study Actions: {total_activities} | Keep up the great work! 🎓")
@@ -635,11 +1640,9 @@ async def studytips(ctx, subject: Option(str, "Subject you're studying") = None)
     await ctx.defer()
     try:
         if subject:
-            prompt = f"Provide effective study tips and strategies specifically for {subject}."
+            response = await generate_from_template("studytips_subject", subject=subject)
         else:
-            prompt = "Provide general study tips and strategies for academic success."
-        
-        response = await async_generate(prompt)
+            response = await generate_from_template("studytips_general")
         embed = make_embed("💡 Study Tips", response.text, color=0xf39c12)
         await ctx.followup.send(embed=embed)
     except Exception:
@@ -649,8 +1652,7 @@ async def studytips(ctx, subject: Option(str, "Subject you're studying") = None)
 async def summarize(ctx, content: Option(str, "Topic or text to summarize")):
     await ctx.defer()
     try:
-        prompt = f"Provide a clear, concise summary of: {content}\nHighlight the key points."
-        response = await async_generate(prompt)
+        response = await generate_from_template("summarize", content=content)
         embed = make_embed("📋 Summary", response.text, color=0x95a5a6)
         await ctx.followup.send(embed=embed)
     except Exception:
@@ -660,8 +1662,7 @@ async def summarize(ctx, content: Option(str, "Topic or text to summarize")):
 async def compare(ctx, concept1: Option(str, "First concept"), concept2: Option(str, "Second concept")):
     await ctx.defer()
     try:
-        prompt = f"Compare and contrast '{concept1}' and '{concept2}'. Show similarities, differences, and key distinctions."
-        response = await async_generate(prompt)
+        response = await generate_from_template("compare", concept1=concept1, concept2=concept2)
         embed = make_embed(f"⚖️ Comparison", response.text, color=0x16a085)
         await ctx.followup.send(embed=embed)
     except Exception:
@@ -670,6 +1671,11 @@ async def compare(ctx, concept1: Option(str, "First concept"), concept2: Option(
 @bot.slash_command(description="Export your study history and notes")
 async def export(ctx):
     user_id = ctx.author.id
+    try:
+        record = await working_set.get(user_id, create=False) or UserRecord()
+    except OSError:
+        await ctx.respond(USER_DATA_UNAVAILABLE, ephemeral=True)
+        return
     export_data = []
     
     if ctx.channel.id in channel_history and channel_history[ctx.channel.id]:
@@ -678,19 +1684,19 @@ async def export(ctx):
             export_data.append(f"\nQ{i}: {q}")
             export_data.append(f"A{i}: {a}\n")
     
-    if user_id in user_flashcards and user_flashcards[user_id]:
+    if record.flashcards:
         export_data.append("\n=== FLASHCARDS ===\n")
-        for i, card in enumerate(user_flashcards[user_id], 1):
+        for i, card in enumerate(record.flashcards, 1):
             export_data.append(f"\nCard {i}:")
-            export_data.append(f"Q: {card['question']}")
-            export_data.append(f"A: {card['answer']}\n")
+            export_data.append(f"Q: {card.question}")
+            export_data.append(f"A: {card.answer}\n")
     
-    if user_id in user_quiz_scores:
-        scores = user_quiz_scores[user_id]
-        accuracy = (scores["correct"] / scores["total"] * 100) if scores["total"] > 0 else 0
+    if record.quiz is not None:
+        scores = record.quiz
+        accuracy = (scores.correct / scores.total * 100) if scores.total > 0 else 0
         export_data.append("\n=== QUIZ STATISTICS ===")
-        export_data.append(f"\nCorrect Answers: {scores['correct']}")
-        export_data.append(f"Total Attempts: {scores['total']}")
+        export_data.append(f"\nCorrect Answers: {scores.correct}")
+        export_data.append(f"Total Attempts: {scores.total}")
         export_data.append(f"Accuracy: {accuracy:.1f}%\n")
     
     if export_data:
@@ -708,6 +1714,97 @@ async def export(ctx):
     else:
         await ctx.respond("📭 No data to export yet. Start studying to build your history!")
 
+@bot.slash_command(description="Show runtime diagnostics (admins only)")
+@discord.default_permissions(administrator=True)
+async def diagnostics(
+    ctx,
+    report: Option(str, "Report to show", choices=["Overview", "Memory Snapshot", "Stop Memory Tracing", "Slow Callbacks"]) = "Overview",
+    top: Option(int, "Number of entries to show", min_value=1, max_value=20) = 10
+):
+    if not await is_bot_admin(ctx):
+        await ctx.respond("⛔ This command is only available to bot admins.", ephemeral=True)
+        return
+
+    if report == "Stop Memory Tracing":
+        if tracemalloc.is_tracing():
+            stop_memory_tracing()
+            await ctx.respond("🧠 tracemalloc stopped.", ephemeral=True)
+        else:
+            await ctx.respond("🧠 tracemalloc is not running.", ephemeral=True)
+        return
+
+    await ctx.defer(ephemeral=True)
+
+    if report == "Memory Snapshot":
+        was_tracing = tracemalloc.is_tracing()
+        top_stats, growth = await tracemalloc_report(top)
+        current, peak = tracemalloc.get_traced_memory()
+        embed = discord.Embed(title="🧠 Memory Snapshot", color=0x9b59b6)
+        if not was_tracing:
+            embed.description = (
+                "tracemalloc was just started; only allocations from now on are traced. Run again later to see growth. "
+                f"It stops by itself after {TRACEMALLOC_MAX_SECONDS // 60} minutes, or use **Stop Memory Tracing**."
+            )
+        embed.add_field(
+            name=f"Top {top} Allocations",
+            value="\n".join(_format_stat_line(stat, stat.size) for stat in top_stats)[:1024] or "Nothing traced yet",
+            inline=False
+        )
+        if growth:
+            embed.add_field(
+                name="Growth Since Last Snapshot",
+                value="\n".join(_format_stat_line(stat, stat.size_diff) for stat in growth)[:1024],
+                inline=False
+            )
+        embed.set_footer(text=f"Traced: {_format_bytes(current)} | Peak: {_format_bytes(peak)}")
+        await ctx.respond(embed=embed, ephemeral=True)
+        return
+
+    if report == "Slow Callbacks":
+        embed = discord.Embed(title="🐢 Slow Callbacks", color=0xe67e22)
+        if not slow_callbacks:
+            embed.description = f"No callbacks have blocked the event loop for more than {SLOW_CALLBACK_THRESHOLD}s."
+        for entry in list(slow_callbacks)[::-1][:min(top, 5)]:
+            embed.add_field(
+                name=f"{entry['time']:%H:%M:%S} blocked {entry['blocked']:.2f}s",
+                value=f"```{entry['stack'][-1000:]}```",
+                inline=False
+            )
+        await ctx.respond(embed=embed, ephemeral=True)
+        return
+
+    lag = loop_lag_summary()
+    embed = discord.Embed(title="🩺 Bot Diagnostics", color=0x3498db)
+    embed.add_field(
+        name="⏱️ Event Loop Lag",
+        value=(
+            f"Last: {lag['last_ms']} ms\nAverage: {lag['avg_ms']} ms\nMax: {lag['max_ms']} ms\n"
+            f"Warnings (≥{LOOP_LAG_WARNING * 1000:.0f} ms): {lag['warnings']}\n"
+            f"Critical (≥{LOOP_LAG_CRITICAL * 1000:.0f} ms): {lag['critical']}"
+        ),
+        inline=False
+    )
+    for name, usage in (await memory_report()).items():
+        value = f"Keys: {usage['keys']}\nItems: {usage['items']}"
+        if usage["bytes"]:
+            value += f"\nSize: {_format_bytes(usage['bytes'])}"
+        embed.add_field(name=name, value=value, inline=True)
+    for key in gemini_pool.status():
+        if key["remaining_rpm"] is None:
+            quota = f"Sent: {key['sent_last_min']} in the last minute"
+        else:
+            quota = f"Quota left: {key['remaining_rpm']}/min"
+        embed.add_field(
+            name=f"🔑 Gemini {key['key']}",
+            value=(
+                f"{quota}\nLatency: {key['latency_s']}s\n"
+                f"Requests: {key['requests']} ({key['errors']} errors)\nCooldown: {key['cooldown_s']}s"
+            ),
+            inline=True
+        )
+    embed.set_footer(text=f"Slow callbacks captured: {len(slow_callbacks)} | tracemalloc: {'on' if tracemalloc.is_tracing() else 'off'}")
+    await ctx.respond(embed=embed, ephemeral=True)
+
 @bot.slash_command(description="Show all available commands and features")
 async def help(ctx):
     embed = discord.Embed(
@@ -731,7 +1828,7 @@ async def help(ctx):
     embed.add_field(
         name="📝 Quiz & Practice",
         value=(
-            "`/quiz` - Generate quizzes (Multiple Choice/True-False/Fill-in-Blank)\n"
+            "`/quiz` - Generate quizzes (Multiple Choice/True-False/Fill-in-Blank), or a session with `questions`\n"
             "`/practice` - Get practice problems\n"
             "`/flashcard` - Create study flashcards\n"
             "`/review` - Review flashcards with spaced repetition"
@@ -779,5 +1876,6 @@ async def help(ctx):
 # =============================
 # RUN
 # =============================
-keep_alive()
-bot.run(BOT_TOKEN)
+if __name__ == "__main__":
+    keep_alive()
+    bot.run(BOT_TOKEN)
@@ -0,0 +1,248 @@
+"""Local fast path for /math: solve plain math with sympy in a worker pool.
+
+This module has no import-time side effects, so pool workers can import it
+under any multiprocessing start method.
+"""
+import asyncio
+import multiprocessing
+import re
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import sympy
+from sympy.parsing.sympy_parser import (
+    parse_expr,
+    standard_transformations,
+    implicit_multiplication_application,
+    convert_xor,
+)
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MATH_MAX_LENGTH = 200
+MATH_CPU_LIMIT = 2  # CPU seconds per problem inside a worker
+MATH_TIMEOUT = 5  # wall-clock seconds before giving up on a worker
+MATH_WORKERS = 2
+
+MATH_NAMES = {
+    "sin", "cos", "tan", "cot", "sec", "csc", "asin", "acos", "atan",
+    "sinh", "cosh", "tanh", "log", "ln", "exp", "sqrt", "abs", "pi", "oo",
+}
+MATH_ALLOWED = re.compile(r"[0-9a-z+\-*/^().=!\s]+")
+MATH_DERIVATIVE = re.compile(
+    r"^(?:find\s+the\s+)?(?:derivative\s+of|differentiate|d/d([a-z]))\s*(.+)$")
+MATH_INTEGRAL = re.compile(
+    r"^(?:find\s+the\s+)?(?:integral\s+of|integrate|antiderivative\s+of)\s*(.+)$")
+MATH_PREFIX = re.compile(
+    r"^(?:solve|simplify|evaluate|calculate|compute|what\s+is|find)\b(?:\s+for\s+([a-z])\b)?\s*:?\s*")
+MATH_RESPECT_TO = re.compile(r"\s*(?:with\s+respect\s+to|wrt)\s+([a-z])\s*$")
+MATH_TRANSFORMATIONS = standard_transformations + (implicit_multiplication_application, convert_xor)
+
+math_pool = None
+math_pool_warmup = []
+
+def parse_math_problem(problem):
+    """Classify a /math problem as (kind, expression, variable), or None if it isn't plain math."""
+    text = problem.strip().lower().rstrip("?.").strip()
+    if not text or len(text) > MATH_MAX_LENGTH:
+        return None
+
+    kind, variable = "expression", None
+    match = MATH_DERIVATIVE.match(text)
+    if match:
+        kind, variable, text = "derivative", match.group(1), match.group(2)
+    else:
+        match = MATH_INTEGRAL.match(text)
+        if match:
+            kind, text = "integral", match.group(1)
+            dx = re.search(r"\s*d([a-z])\s*$", text)
+            if dx:
+                variable, text = dx.group(1), text[:dx.start()]
+        else:
+            prefix = MATH_PREFIX.match(text)
+            if prefix:
+                variable, text = prefix.group(1), text[prefix.end():]
+
+    respect_to = MATH_RESPECT_TO.search(text)
+    if respect_to and kind != "expression":
+        variable, text = respect_to.group(1), text[:respect_to.start()]
+
+    text = text.strip()
+    if not text or not MATH_ALLOWED.fullmatch(text):
+        return None
+    # Reject anything with words we don't know, so word problems go to Gemini
+    if any(len(word) > 1 and word not in MATH_NAMES for word in re.findall(r"[a-z]+", text)):
+        return None
+
+    if "=" in text:
+        if kind != "expression" or text.count("=") != 1:
+            return None
+        kind = "equation"
+    return kind, text, variable
+
+def _format_math(expr):
+    return sympy.sstr(expr).replace("**", "^")
+
+def _parse_math(text):
+    return parse_expr(text, local_dict={"e": sympy.E, "ln": sympy.log}, transformations=MATH_TRANSFORMATIONS)
+
+def _pick_variable(expr, variable):
+    if variable:
+        return sympy.Symbol(variable)
+    symbols = sorted(expr.free_symbols, key=lambda s: s.name)
+    if len(symbols) == 1:
+        return symbols[0]
+    if sympy.Symbol("x") in symbols or not symbols:
+        return sympy.Symbol("x")
+    return None
+
+def _solve_math(kind, text, variable):
+    steps = []
+
+    if kind == "equation":
+        lhs_text, rhs_text = text.split("=")
+        lhs, rhs = _parse_math(lhs_text), _parse_math(rhs_text)
+        steps.append(("Equation", f"{_format_math(lhs)} = {_format_math(rhs)}"))
+        moved = sympy.expand(lhs - rhs)
+        if rhs != 0:
+            steps.append(("Move everything to one side", f"{_format_math(moved)} = 0"))
+        if sympy.simplify(moved) == 0:
+            steps.append(("Simplify", "0 = 0"))
+            symbols = sorted(lhs.free_symbols | rhs.free_symbols, key=lambda s: s.name)
+            answer = "True"
+            if symbols:
+                answer += " for all values of " + ", ".join(s.name for s in symbols)
+        elif not moved.free_symbols:
+            answer = "No solution (the equation is never true)"
+        else:
+            var = _pick_variable(moved, variable)
+            if var is None or var not in moved.free_symbols:
+                return None
+            factored = sympy.factor(moved)
+            if factored != moved:
+                steps.append(("Factor", f"{_format_math(factored)} = 0"))
+            solutions = sympy.solveset(moved, var)
+            if solutions is sympy.S.EmptySet:
+                answer = "No solution"
+            elif isinstance(solutions, sympy.FiniteSet):
+                solutions = sorted(solutions, key=sympy.default_sort_key)
+                answer = ", ".join(f"{var} = {_format_math(s)}" for s in solutions)
+                approx = [sympy.N(s, 6) for s in solutions if s.is_number and not s.is_Rational]
+                if approx:
+                    answer += " (≈ " + ", ".join(_format_math(a) for a in approx) + ")"
+            else:
+                # Periodic or conditional solution sets; let Gemini explain these
+                return None
+    elif kind == "derivative":
+        expr = _parse_math(text)
+        var = _pick_variable(expr, variable)
+        if var is None:
+            return None
+        steps.append(("Function", f"f({var}) = {_format_math(expr)}"))
+        derivative = sympy.diff(expr, var)
+        steps.append((f"Differentiate with respect to {var}", _format_math(derivative)))
+        answer = f"f'({var}) = {_format_math(sympy.simplify(derivative))}"
+    elif kind == "integral":
+        expr = _parse_math(text)
+        var = _pick_variable(expr, variable)
+        if var is None:
+            return None
+        steps.append(("Integrand", f"{_format_math(expr)} d{var}"))
+        integral = sympy.integrate(expr, var)
+        if integral.has(sympy.Integral):
+            return None
+        answer = f"{_format_math(sympy.simplify(integral))} + C"
+    else:
+        expr = _parse_math(text)
+        steps.append(("Expression", _format_math(expr)))
+        result = sympy.simplify(expr)
+        if result.is_number:
+            answer = _format_math(result)
+            if not result.is_Rational:
+                answer += f" ≈ {_format_math(sympy.N(result, 10))}"
+            elif not result.is_Integer:
+                answer += f" = {_format_math(sympy.N(result, 10))}"
+        else:
+            answer = _format_math(result)
+
+    lines = [f"**Step {i}: {label}**\n`{value}`" for i, (label, value) in enumerate(steps, 1)]
+    lines.append(f"**✅ Answer**\n`{answer}`")
+    text = "\n\n".join(lines)
+    return text if len(text) <= 4000 else None
+
+def _math_cpu_exceeded(signum, frame):
+    raise TimeoutError("Math solver exceeded its CPU time limit")
+
+def _math_worker_init():
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, _math_cpu_exceeded)
+
+def solve_math_locally(kind, text, variable):
+    """Worker entry point: solve with sympy under a CPU limit, returning rendered steps or None."""
+    limits = None
+    if resource is not None:
+        limits = resource.getrlimit(resource.RLIMIT_CPU)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime) + MATH_CPU_LIMIT
+        if limits[1] != resource.RLIM_INFINITY:
+            soft = min(soft, limits[1])
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, limits[1]))
+    try:
+        return _solve_math(kind, text, variable)
+    except Exception:
+        return None
+    finally:
+        if limits is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, limits)
+
+def _warm_up_worker():
+    _parse_math("x + 1")
+
+def start_math_pool():
+    """Spawn the worker pool and start warming it up; /math uses Gemini until it is ready."""
+    global math_pool, math_pool_warmup
+    if math_pool is not None:
+        return math_pool
+    # spawn avoids forking a process that already runs Flask, gRPC and executor threads
+    math_pool = ProcessPoolExecutor(
+        max_workers=MATH_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_math_worker_init
+    )
+    math_pool_warmup = [math_pool.submit(_warm_up_worker) for _ in range(MATH_WORKERS)]
+    return math_pool
+
+def _reset_math_pool(pool):
+    """Drop a failed pool, killing any worker stuck in a runaway computation."""
+    global math_pool
+    if math_pool is not pool:
+        # Another caller already replaced it; don't tear down the new pool
+        return
+    for process in list(getattr(pool, "_processes", {}).values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+    math_pool = None
+
+async def async_solve_math(problem):
+    """Try the local math engine; return rendered steps, or None to fall back to Gemini."""
+    parsed = parse_math_problem(problem)
+    if parsed is None:
+        return None
+
+    pool = start_math_pool()
+    if not all(future.done() for future in math_pool_warmup):
+        return None
+
+    loop = asyncio.get_event_loop()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(pool, solve_math_locally, *parsed),
+            timeout=MATH_TIMEOUT
+        )
+    except (asyncio.TimeoutError, BrokenProcessPool):
+        _reset_math_pool(pool)
+        return None